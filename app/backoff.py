@@ -0,0 +1,25 @@
+import random
+from typing import Optional
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    # litellm errors carry the httpx response; the legacy openai SDK exposes headers directly
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(error: Exception, attempt: int, base: float = 1.0, cap: float = 30.0) -> Optional[float]:
+    """Seconds to wait before retry number `attempt` (0-based) after a 429.
+    Honors Retry-After when the provider sends it, otherwise exponential backoff, plus jitter.
+    Returns None when Retry-After is longer than `cap`: the caller should give up and fail over
+    instead of holding the request that long."""
+    delay = min(cap, base * 2 ** attempt)
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        if retry_after > cap:
+            return None
+        delay = max(delay, retry_after)
+    return min(cap, delay + random.uniform(0, base))
@@ -1,3 +1,4 @@
+import os
 from celery import Celery
 
 celery_app = Celery(
@@ -6,4 +7,36 @@ celery_app = Celery(
     backend="redis://localhost:6379/0",
     include=["app.tasks"]
 )
-celery_app.conf.update(task_track_started=True)
\ No newline at end of file
+celery_app.conf.update(
+    task_track_started=True,
+    # Reuse broker/backend TCP connections instead of reconnecting per publish
+    broker_pool_limit=int(os.getenv("CELERY_BROKER_POOL", "20")),
+    broker_connection_retry_on_startup=True,
+    broker_transport_options={
+        "socket_keepalive": True,
+        "socket_timeout": 5,
+        "health_check_interval": 30,
+        "visibility_timeout": 3600,
+    },
+    result_backend_transport_options={"global_keyprefix": "stp:"},
+    # The Redis result backend ignores socket options in its transport options; it reads these instead
+    redis_socket_keepalive=True,
+    redis_backend_health_check_interval=30,
+    result_expires=3600,
+    # msgpack keeps plan payloads smaller and faster to encode than stdlib JSON
+    task_serializer="msgpack",
+    result_serializer="msgpack",
+    accept_content=["msgpack", "json"],
+    result_accept_content=["msgpack", "json"],
+    # Plan generation blocks on the LLM for seconds: reserve one task at a time so idle
+    # workers pick up queued plans, and ack only after the task finishes
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    worker_max_tasks_per_child=int(os.getenv("CELERY_MAX_TASKS_PER_CHILD", "100")),
+    task_routes={"app.tasks.generate_plan_task": {"queue": "planner"}},
+)
+
+def task_owner_key(task_id: str) -> str:
+    """Redis key recording which user queued a task, next to its result meta."""
+    prefix = celery_app.conf.result_backend_transport_options.get("global_keyprefix", "")
+    return f"{prefix}task-owner:{task_id}"
@@ -1,59 +1,280 @@
 import os
+import json
 import time
+import asyncio
+import logging
 import socket
-from urllib.parse import urlparse
-from sqlmodel import create_engine, SQLModel
+import stat
+import tempfile
+from functools import lru_cache
+from fastapi import HTTPException, status
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+from sqlalchemy import exists, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine, Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from dotenv import load_dotenv
+from .models import User
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL not set")
+# Set once tables exist; request handlers wait on it instead of the server blocking at boot
+db_ready = asyncio.Event()
 
-# Configure engine with safer defaults for cloud providers (Supabase/Render)
-connect_args = {}
-engine_kwargs = {
-    "echo": False,
-    "pool_pre_ping": True,
-    "pool_recycle": 300,
-}
+# Resolved A-records, shared in-process and across workers via a small JSON file.
+# The file feeds libpq's hostaddr and sslmode=require doesn't verify the server, so it lives in
+# a per-user 0700 directory that is checked before use; otherwise only the in-process cache is used.
+_dns_cache = {}
+
+def _dns_cache_file():
+    if not hasattr(os, "getuid"):
+        return None
+    uid = os.getuid()
+    cache_dir = os.path.join(tempfile.gettempdir(), f"stp-dns-{uid}")
+    try:
+        os.mkdir(cache_dir, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return None
+    try:
+        st = os.lstat(cache_dir)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != uid or stat.S_IMODE(st.st_mode) & 0o077:
+        logger.warning(f"Ignoring DNS cache dir {cache_dir}: not a private directory owned by this user")
+        return None
+    return os.path.join(cache_dir, "dns_cache.json")
+
+def _load_dns_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _resolve_ipv4(hostname: str, ttl: int = 900):
+    now = time.monotonic()
+    cached = _dns_cache.get(hostname)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    cache_file = _dns_cache_file()
+    # Wall-clock expiry on disk since monotonic clocks differ between processes
+    entry = _load_dns_file(cache_file).get(hostname) if cache_file else None
+    if entry and entry.get("expires_at", 0) > time.time():
+        _dns_cache[hostname] = (entry["addr"], now + (entry["expires_at"] - time.time()))
+        return entry["addr"]
+
+    infos = socket.getaddrinfo(hostname, None, family=socket.AF_INET)
+    if not infos:
+        return None
+    addr = infos[0][4][0]
+    _dns_cache[hostname] = (addr, now + ttl)
+    if not cache_file:
+        return addr
+    try:
+        data = _load_dns_file(cache_file)
+        data[hostname] = {"addr": addr, "expires_at": time.time() + ttl}
+        tmp_path = f"{cache_file}.{os.getpid()}"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, cache_file)
+    except OSError:
+        # Disk cache is best-effort; the in-process entry is enough
+        pass
+    return addr
 
-if DATABASE_URL.lower().startswith("postgresql"):
-    # Ensure SSL is required and use small pools for web dynos
-    connect_args["sslmode"] = os.getenv("DB_SSLMODE", "require")
-    engine_kwargs.update({
-        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
-        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
-    })
-    # Prefer IPv4 hostaddr to avoid IPv6 egress issues on some platforms
-    force_ipv4 = os.getenv("DB_FORCE_IPV4", "true").lower() == "true"
+def _forced_ipv4(database_url: str):
+    """(hostname, IPv4 address) to pin connections to, or (hostname, None) when disabled or unresolvable."""
+    hostname = None
     try:
-        parsed = urlparse(DATABASE_URL)
-        hostname = parsed.hostname
-        if force_ipv4 and hostname:
-            infos = socket.getaddrinfo(hostname, None, family=socket.AF_INET)
-            if infos:
-                ipv4_addr = infos[0][4][0]
-                # Force IPv4 via both libpq env and connect args
-                os.environ["PGHOSTADDR"] = ipv4_addr
-                os.environ["PGHOST"] = hostname
-                connect_args["hostaddr"] = ipv4_addr
-                connect_args["host"] = hostname
+        hostname = urlparse(database_url).hostname
+        if hostname and os.getenv("DB_FORCE_IPV4", "true").lower() == "true":
+            return hostname, _resolve_ipv4(hostname, ttl=int(os.getenv("DB_DNS_TTL", "900")))
     except Exception:
         # Non-fatal; continue without hostaddr
         pass
+    return hostname, None
+
+@lru_cache(maxsize=1)
+def get_engine():
+    """Build the engine on first use so importing this module stays cheap."""
+    load_dotenv()
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise RuntimeError("DATABASE_URL not set")
+
+    # Configure engine with safer defaults for cloud providers (Supabase/Render)
+    connect_args = {}
+    # Pre-ping costs an extra SELECT 1 per checkout; disable it for local databases
+    engine_kwargs = {
+        "echo": os.getenv("DB_ECHO", "false").lower() == "true",
+        "pool_pre_ping": os.getenv("DB_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "300")),
+    }
 
-    # Keep connection attempts short to fail fast on cold boots
-    connect_args["connect_timeout"] = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+    if database_url.lower().startswith("postgresql"):
+        # Ensure SSL is required and use small pools for web dynos
+        connect_args["sslmode"] = os.getenv("DB_SSLMODE", "require")
+        engine_kwargs.update({
+            "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        })
+        # Prefer IPv4 hostaddr to avoid IPv6 egress issues on some platforms
+        hostname, ipv4_addr = _forced_ipv4(database_url)
+        if ipv4_addr:
+            # Force IPv4 via both libpq env and connect args
+            os.environ["PGHOSTADDR"] = ipv4_addr
+            os.environ["PGHOST"] = hostname
+            connect_args["hostaddr"] = ipv4_addr
+            connect_args["host"] = hostname
+
+        # Keep connection attempts short to fail fast on cold boots
+        connect_args["connect_timeout"] = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+        # libpq TCP keepalives let the kernel detect dead connections without a query
+        connect_args.update({
+            "keepalives": 1,
+            "keepalives_idle": int(os.getenv("DB_KEEPALIVES_IDLE", "30")),
+            "keepalives_interval": int(os.getenv("DB_KEEPALIVES_INTERVAL", "10")),
+            "keepalives_count": int(os.getenv("DB_KEEPALIVES_COUNT", "5")),
+        })
+
+    return create_engine(database_url, connect_args=connect_args, **engine_kwargs)
+
+def dispose_engine(close: bool = True):
+    # Only touch an engine that was actually built; forked children pass
+    # close=False so they drop inherited sockets without closing the parent's
+    if get_engine.cache_info().currsize:
+        get_engine().dispose(close=close)
+
+# Async drivers used when DATABASE_ASYNC_URL is not set explicitly
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args, **engine_kwargs)
+def _async_database_url(database_url: str) -> str:
+    scheme, sep, rest = database_url.partition("://")
+    driver = _ASYNC_DRIVERS.get(scheme.split("+")[0].lower(), scheme)
+    return f"{driver}{sep}{rest}"
+
+def _pop_sslmode(database_url: str):
+    """Strip libpq's sslmode from the query string (asyncpg.connect rejects it) and return it."""
+    parsed = urlparse(database_url)
+    query = parse_qsl(parsed.query, keep_blank_values=True)
+    sslmode = next((value for key, value in query if key == "sslmode"), None)
+    if sslmode is None:
+        return database_url, None
+    remaining = urlencode([(key, value) for key, value in query if key != "sslmode"])
+    return urlunparse(parsed._replace(query=remaining)), sslmode
+
+@lru_cache(maxsize=1)
+def get_async_engine():
+    """Async counterpart of get_engine() for handlers that await their queries."""
+    load_dotenv()
+
+    database_url = os.getenv("DATABASE_ASYNC_URL")
+    if not database_url:
+        sync_url = os.getenv("DATABASE_URL")
+        if not sync_url:
+            raise RuntimeError("DATABASE_URL not set")
+        database_url = _async_database_url(sync_url)
+
+    connect_args = {}
+    engine_kwargs = {
+        "echo": os.getenv("DB_ECHO", "false").lower() == "true",
+        "pool_pre_ping": os.getenv("DB_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "300")),
+    }
+
+    if database_url.lower().startswith("postgresql"):
+        database_url, url_sslmode = _pop_sslmode(database_url)
+        # asyncpg takes libpq-style sslmode names via "ssl"
+        connect_args["ssl"] = os.getenv("DB_SSLMODE") or url_sslmode or "require"
+        connect_args["timeout"] = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+        # Same IPv4 pinning as the sync engine; asyncpg has no hostaddr, so connect to the address.
+        # Certificates aren't hostname-verified under sslmode=require, matching libpq.
+        _, ipv4_addr = _forced_ipv4(database_url)
+        if ipv4_addr:
+            connect_args["host"] = ipv4_addr
+        # asyncpg exposes no client TCP keepalive options; have the server probe idle
+        # connections with the same timings so dead peers are still dropped.
+        # Disable for poolers such as PgBouncer that reject unknown startup parameters.
+        if os.getenv("DB_SERVER_KEEPALIVES", "true").lower() == "true":
+            connect_args["server_settings"] = {
+                "tcp_keepalives_idle": os.getenv("DB_KEEPALIVES_IDLE", "30"),
+                "tcp_keepalives_interval": os.getenv("DB_KEEPALIVES_INTERVAL", "10"),
+                "tcp_keepalives_count": os.getenv("DB_KEEPALIVES_COUNT", "5"),
+            }
+        engine_kwargs.update({
+            "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        })
+
+    return create_async_engine(database_url, connect_args=connect_args, **engine_kwargs)
+
+async def dispose_async_engine():
+    if get_async_engine.cache_info().currsize:
+        await get_async_engine().dispose()
+
+def get_session():
+    with Session(get_engine()) as session:
+        yield session
+
+async def wait_for_db(timeout: float = None):
+    if db_ready.is_set():
+        return
+    timeout = timeout if timeout is not None else float(os.getenv("DB_READY_TIMEOUT", "10"))
+    try:
+        await asyncio.wait_for(db_ready.wait(), timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database is starting up")
+
+async def get_async_session():
+    await wait_for_db()
+    # Keep attributes loaded after commit so handlers can read them without another await
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
+
+def _create_schema(engine):
+    """Create missing tables, then any indexes added to tables that already exist."""
+    SQLModel.metadata.create_all(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    _lowercase_user_emails(engine)
+
+def _lowercase_user_emails(engine):
+    """Signup and login match emails lowercased; bring accounts stored before that in line.
+    Rows whose lowercase form is already taken are left alone instead of breaking the unique index."""
+    other = User.__table__.alias("other")
+    stmt = (
+        update(User)
+        .where(
+            User.email != func.lower(User.email),
+            ~exists().where(other.c.email == func.lower(User.email))
+        )
+        .values(email=func.lower(User.email))
+    )
+    try:
+        with engine.begin() as conn:
+            updated = conn.execute(stmt).rowcount
+    except IntegrityError as e:
+        # Two mixed-case spellings of the same address; those accounts need a manual merge
+        logger.warning(f"Could not lowercase existing user emails: {e}")
+        return
+    if updated:
+        logger.info(f"✅ Lowercased {updated} existing user email(s)")
 
 def create_db_and_tables(retries: int = 5, delay: float = 2.0):
     last_err = None
     for attempt in range(1, retries + 1):
         try:
-            SQLModel.metadata.create_all(engine)
+            _create_schema(get_engine())
             return
         except Exception as e:
             last_err = e
@@ -61,3 +282,15 @@ def create_db_and_tables(retries: int = 5, delay: float = 2.0):
                 time.sleep(delay)
             else:
                 raise last_err
+
+async def init_db_with_retry(retries: int = 5, delay: float = 2.0):
+    for attempt in range(1, retries + 1):
+        try:
+            await asyncio.to_thread(_create_schema, get_engine())
+            db_ready.set()
+            return
+        except Exception as e:
+            logger.error(f"Database init attempt {attempt}/{retries} failed: {e}")
+            if attempt == retries:
+                raise
+            await asyncio.sleep(delay)
@@ -1,18 +1,95 @@
 import os
-import json
+import re
 import asyncio
-from typing import List, Dict, Any, Optional
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
+import httpx
 import litellm
-from litellm import completion
+import orjson
+import redis.asyncio as aioredis
+from litellm import acompletion
 import logging
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+from dotenv import load_dotenv
+from .backoff import retry_delay
 from .models import Task, TaskStatus
+from .normalize import normalize_goal
+
+# Provider keys are read at import, so load .env before the singleton below is built
+load_dotenv()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# One pooled client for all provider calls so TCP/TLS connections are reused
+litellm.aclient_session = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+)
+
+# Markdown code fences some models wrap around their JSON output
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.M)
+
+# Rate-limited calls are retried with backoff this many times before moving to the next model
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+# Send the single-shot prompt to every provider at once instead of trying them in turn.
+# Cuts tail latency when one provider is slow, at the cost of paying for the losing calls.
+LLM_RACE_PROVIDERS = os.getenv("LLM_RACE_PROVIDERS", "false").lower() == "true"
+
+# Generated plans are cached by normalized goal; connections are opened lazily on first use
+PLAN_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+# Short timeouts so an unreachable Redis costs a logged warning, not a hung request
+redis_client = aioredis.Redis.from_url(
+    os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+    socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", "0.5")),
+    socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "1")),
+)
+
+# Goal hash -> future of the generation currently running for it (per process)
+_inflight: Dict[str, "asyncio.Future[List[TaskBreakdown]]"] = {}
+
+# Static prompts live at module scope so identical prefixes can hit provider-side prompt caches
+DRAFT_SYSTEM = (
+    "You are an expert project manager. Return ONLY a JSON array of task stubs for the goal, "
+    "where each item has: task_name (string only). 5-8 tasks."
+)
+
+ELABORATE_SYSTEM = (
+    "You are a senior project planner. Expand the provided task into a detailed, unique specification. "
+    "Return ONLY JSON with keys: description, duration, dependencies, phase, priority."
+)
+
+ELABORATE_CONSTRAINTS = (
+    "Constraints:\n"
+    "- Provide realistic duration (e.g., '2 days', '1 week').\n"
+    "- If no blocking work, set dependencies to 'None'.\n"
+    "- Phase must be one of: Planning, Research, Design, Implementation, Testing, Launch, Maintenance.\n"
+    "- Priority must be one of: high, medium, low.\n"
+    "Respond with only JSON: {\"description\":..., \"duration\":..., \"dependencies\":..., \"phase\":..., \"priority\":...}"
+)
+
+FALLBACK_SYSTEM_PROMPT = """You are an expert project manager and task planning AI. Your job is to break down user goals into actionable tasks with realistic timelines.
+
+IMPORTANT: You must respond with ONLY a valid JSON array. No other text, explanations, or markdown formatting.
+
+The JSON should contain an array of task objects, each with these exact fields:
+- task_name: string (concise task title)
+- description: string (detailed description of what needs to be done)
+- duration: string (e.g., "2 days", "1 week", "3 hours")
+- dependencies: string (what must be completed before this task, or "None")
+- phase: string (project phase: Planning, Research, Design, Implementation, Testing, Launch, or Maintenance)
+- priority: string ("high", "medium", or "low")
+
+Consider:
+- Logical task dependencies and sequencing
+- Realistic time estimates
+- Proper project phases
+- Risk mitigation and planning tasks
+- Testing and quality assurance
+- Documentation and handover"""
+
 @dataclass
 class TaskBreakdown:
     task_name: str
@@ -22,30 +99,42 @@ class TaskBreakdown:
     phase: str
     priority: str
 
+# Receives the text streamed so far for the current LLM call
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+@dataclass(frozen=True)
+class LLMProvider:
+    model: str
+    api_key: str
+    provider: str
+
+# Keys every single-shot task object must provide; mirrors TaskBreakdown
+TASK_FIELDS = frozenset(('task_name', 'description', 'duration', 'dependencies', 'phase', 'priority'))
+
 class LLMService:
     def __init__(self):
-        self.providers = []
-        self._setup_providers()
+        self.providers: Tuple[LLMProvider, ...] = self._setup_providers()
         
-    def _setup_providers(self):
+    def _setup_providers(self) -> Tuple[LLMProvider, ...]:
         """Setup multiple LLM providers based on available API keys"""
+        providers = []
         
         # OpenAI
         if os.getenv("OPENAI_API_KEY"):
-            self.providers.append({
-                "model": os.getenv("LLM_OPENAI_MODEL", "gpt-3.5-turbo"),
-                "api_key": os.getenv("OPENAI_API_KEY"),
-                "provider": "openai"
-            })
+            providers.append(LLMProvider(
+                model=os.getenv("LLM_OPENAI_MODEL", "gpt-3.5-turbo"),
+                api_key=os.getenv("OPENAI_API_KEY"),
+                provider="openai"
+            ))
             logger.info("✓ OpenAI provider configured")
         
         # Anthropic Claude
         if os.getenv("ANTHROPIC_API_KEY"):
-            self.providers.append({
-                "model": os.getenv("LLM_ANTHROPIC_MODEL", "claude-3-haiku-20240307"),
-                "api_key": os.getenv("ANTHROPIC_API_KEY"),
-                "provider": "anthropic"
-            })
+            providers.append(LLMProvider(
+                model=os.getenv("LLM_ANTHROPIC_MODEL", "claude-3-haiku-20240307"),
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                provider="anthropic"
+            ))
             logger.info("✓ Anthropic provider configured")
         
         # Google Gemini
@@ -54,43 +143,66 @@ class LLMService:
             # Normalize model name for litellm gemini adapter
             if not gemini_model.startswith("gemini/"):
                 gemini_model = f"gemini/{gemini_model.lstrip('models/')}"
-            self.providers.append({
-                "model": gemini_model,
-                "api_key": os.getenv("GEMINI_API_KEY"),
-                "provider": "gemini"
-            })
+            providers.append(LLMProvider(
+                model=gemini_model,
+                api_key=os.getenv("GEMINI_API_KEY"),
+                provider="gemini"
+            ))
             logger.info(f"✓ Gemini provider configured ({gemini_model})")
         
-        if not self.providers:
+        if not providers:
             logger.warning("⚠️ No LLM providers configured! Check your .env file.")
+        return tuple(providers)
 
-    def _set_api_key_for_provider(self, provider: Dict[str, str]):
-        if provider['provider'] == 'openai':
-            os.environ["OPENAI_API_KEY"] = provider['api_key']
-        elif provider['provider'] == 'anthropic':
-            os.environ["ANTHROPIC_API_KEY"] = provider['api_key']
-        elif provider['provider'] == 'gemini':
-            os.environ["GEMINI_API_KEY"] = provider['api_key']
+    def _system_message(self, provider: LLMProvider, content: str) -> Dict[str, Any]:
+        # Anthropic only caches prompt prefixes that are explicitly marked
+        if provider.provider == 'anthropic':
+            return {
+                "role": "system",
+                "content": [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+            }
+        return {"role": "system", "content": content}
 
-    async def _call_completion(self, provider: Dict[str, str], messages: List[Dict[str, str]], temperature: float = 0.7, max_tokens: int = 2000) -> str:
-        self._set_api_key_for_provider(provider)
+    async def _call_completion(self, provider: LLMProvider, messages: List[Dict[str, str]], temperature: float = 0.7, max_tokens: int = 2000, stream: bool = False, progress_cb: Optional[ProgressCallback] = None) -> str:
+        """Call the provider, backing off on rate limits before the caller falls over to another model."""
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                return await self._request_completion(provider, messages, temperature, max_tokens, stream, progress_cb)
+            except litellm.RateLimitError as e:
+                delay = retry_delay(e, attempt) if attempt < LLM_MAX_RETRIES else None
+                if delay is None:
+                    raise
+                logger.warning(f"{provider.provider} rate limited, retrying in {delay:.1f}s ({attempt + 1}/{LLM_MAX_RETRIES})")
+                await asyncio.sleep(delay)
+
+    async def _request_completion(self, provider: LLMProvider, messages: List[Dict[str, str]], temperature: float, max_tokens: int, stream: bool, progress_cb: Optional[ProgressCallback]) -> str:
         # Ensure correct gemini model prefix
-        model_name = provider['model']
-        if provider['provider'] == 'gemini' and not model_name.startswith('gemini/'):
+        model_name = provider.model
+        if provider.provider == 'gemini' and not model_name.startswith('gemini/'):
             model_name = f"gemini/{model_name.lstrip('models/')}"
-        response = await asyncio.to_thread(
-            completion,
+        request = dict(
             model=model_name,
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            api_key=provider.api_key,
+            timeout=float(os.getenv("LLM_TIMEOUT", "30"))
         )
-        content = response.choices[0].message.content.strip()
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "").strip()
-        elif content.startswith("```"):
-            content = content.replace("```", "").strip()
-        return content
+        if stream:
+            # Surface partial output as tokens arrive instead of waiting for the full completion
+            parts = []
+            async for chunk in await acompletion(stream=True, **request):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                parts.append(delta)
+                if progress_cb:
+                    await progress_cb("".join(parts))
+            content = "".join(parts).strip()
+        else:
+            response = await acompletion(**request)
+            content = response.choices[0].message.content.strip()
+        return _CODE_FENCE_RE.sub("", content).strip()
 
     def _select_primary_secondary(self):
         """Select primary/secondary providers based on env vars.
@@ -99,7 +211,7 @@ class LLMService:
         """
         if not self.providers:
             return None, None
-        name_to_provider = {p['provider']: p for p in self.providers}
+        name_to_provider = {p.provider: p for p in self.providers}
         primary_name = os.getenv("LLM_PRIMARY_PROVIDER")
         secondary_name = os.getenv("LLM_SECONDARY_PROVIDER")
 
@@ -112,35 +224,92 @@ class LLMService:
             secondary = next((p for p in self.providers if p is not primary), primary)
         return primary, secondary
     
-    async def generate_tasks(self, user_goal: str) -> List[TaskBreakdown]:
-        """Generate tasks using multi-model workflow: one model drafts, another elaborates each task."""
+    def _plan_cache_key(self, user_goal: str) -> str:
+        return "plan:tasks:" + hashlib.sha256(normalize_goal(user_goal).encode()).hexdigest()
+
+    async def _get_cached_tasks(self, cache_key: str) -> Optional[List[TaskBreakdown]]:
+        try:
+            cached = await redis_client.get(cache_key)
+        except Exception as e:
+            # Redis is optional; a cache outage must not block plan generation
+            logger.warning(f"Plan cache read failed: {e}")
+            return None
+        if not cached:
+            return None
+        return [TaskBreakdown(**item) for item in orjson.loads(cached)]
+
+    async def _cache_tasks(self, cache_key: str, tasks: List[TaskBreakdown]):
+        try:
+            await redis_client.setex(cache_key, PLAN_CACHE_TTL, orjson.dumps([asdict(t) for t in tasks]))
+        except Exception as e:
+            logger.warning(f"Plan cache write failed: {e}")
+
+    async def generate_tasks(self, user_goal: str, progress_cb: Optional[ProgressCallback] = None) -> List[TaskBreakdown]:
+        """Generate tasks for a goal, serving repeat goals from the Redis plan cache."""
+        cache_key = self._plan_cache_key(user_goal)
+        cached_tasks = await self._get_cached_tasks(cache_key)
+        if cached_tasks:
+            logger.info(f"✅ Served {len(cached_tasks)} tasks from plan cache")
+            return cached_tasks
+
+        # Concurrent requests for the same goal share one LLM workflow instead of each running it
+        inflight_key = hashlib.blake2b(normalize_goal(user_goal).encode(), digest_size=16).hexdigest()
+        pending = _inflight.get(inflight_key)
+        if pending is not None:
+            logger.info("Joining in-flight generation for identical goal")
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        _inflight[inflight_key] = future
+        try:
+            tasks = await self._generate_tasks_with_llm(user_goal, progress_cb)
+            if tasks is None:
+                tasks = self._get_fallback_tasks(user_goal)
+            elif tasks:
+                await self._cache_tasks(cache_key, tasks)
+            future.set_result(tasks)
+            return tasks
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so a future nobody joined doesn't log an unhandled error
+            future.exception()
+            raise
+        finally:
+            _inflight.pop(inflight_key, None)
+
+    async def _generate_tasks_with_llm(self, user_goal: str, progress_cb: Optional[ProgressCallback] = None) -> Optional[List[TaskBreakdown]]:
+        """Generate tasks using multi-model workflow: one model drafts, another elaborates each task.
+        Returns None when no provider could produce a plan. When progress_cb is given, the draft
+        and single-shot calls are streamed and it receives the partial text.
+        """
         if not self.providers:
             logger.warning("No providers configured, using fallback")
-            return self._get_fallback_tasks(user_goal)
+            return None
         
         primary, secondary = self._select_primary_secondary()
         if not primary:
             logger.warning("No providers configured, using fallback")
-            return self._get_fallback_tasks(user_goal)
+            return None
 
-        draft_system = (
-            "You are an expert project manager. Return ONLY a JSON array of task stubs for the goal, "
-            "where each item has: task_name (string only). 5-8 tasks."
-        )
         draft_user = f"Goal: {user_goal}\nReturn only the JSON array of objects: [{{\"task_name\": \"...\"}}, ...]"
 
         try:
-            logger.info(f"Drafting tasks with {primary['provider']} -> {primary['model']}")
+            logger.info(f"Drafting tasks with {primary.provider} -> {primary.model}")
             draft_json = await self._call_completion(
                 primary,
                 messages=[
-                    {"role": "system", "content": draft_system},
+                    self._system_message(primary, DRAFT_SYSTEM),
                     {"role": "user", "content": draft_user}
                 ],
                 temperature=0.4,
-                max_tokens=400
+                max_tokens=400,
+                stream=progress_cb is not None,
+                progress_cb=progress_cb
             )
-            draft_items = json.loads(draft_json)
+            draft_items = orjson.loads(draft_json)
             if not isinstance(draft_items, list):
                 raise ValueError("Draft response is not a JSON array")
             task_names = [item.get("task_name", "Unnamed Task") for item in draft_items if isinstance(item, dict)]
@@ -154,44 +323,32 @@ class LLMService:
 
         tasks: List[TaskBreakdown] = []
         if task_names:
-            # Elaborate each task with secondary model so each step is distinct
-            for idx, name in enumerate(task_names, start=1):
-                try:
-                    logger.info(f"Elaborating task {idx}/{len(task_names)} with {secondary['provider']}")
-                    elaborate_system = (
-                        "You are a senior project planner. Expand the provided task into a detailed, unique specification. "
-                        "Return ONLY JSON with keys: description, duration, dependencies, phase, priority."
-                    )
-                    elaborate_user = (
-                        f"Goal: {user_goal}\n"
-                        f"Task: {name}\n"
-                        "Constraints:\n"
-                        "- Provide realistic duration (e.g., '2 days', '1 week').\n"
-                        "- If no blocking work, set dependencies to 'None'.\n"
-                        "- Phase must be one of: Planning, Research, Design, Implementation, Testing, Launch, Maintenance.\n"
-                        "- Priority must be one of: high, medium, low.\n"
-                        "Respond with only JSON: {\"description\":..., \"duration\":..., \"dependencies\":..., \"phase\":..., \"priority\":...}"
-                    )
+            # Elaborate each task with secondary model so each step is distinct.
+            # The calls are independent, so run them concurrently under a rate-limit friendly cap.
+            semaphore = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "6")))
+
+            async def elaborate(idx: int, name: str) -> Dict[str, Any]:
+                async with semaphore:
+                    logger.info(f"Elaborating task {idx}/{len(task_names)} with {secondary.provider}")
+                    elaborate_user = f"Goal: {user_goal}\nTask: {name}\n{ELABORATE_CONSTRAINTS}"
                     details_json = await self._call_completion(
                         secondary,
                         messages=[
-                            {"role": "system", "content": elaborate_system},
+                            self._system_message(secondary, ELABORATE_SYSTEM),
                             {"role": "user", "content": elaborate_user}
                         ],
                         temperature=0.7,
                         max_tokens=600
                     )
-                    details = json.loads(details_json)
-                    tasks.append(TaskBreakdown(
-                        task_name=name,
-                        description=details.get("description", f"Detailed work for {name}"),
-                        duration=details.get("duration", "2 days"),
-                        dependencies=details.get("dependencies", "None"),
-                        phase=details.get("phase", "Planning"),
-                        priority=details.get("priority", "medium"),
-                    ))
-                except Exception as e:
-                    logger.error(f"Elaboration failed for '{name}': {e}")
+                    return orjson.loads(details_json)
+
+            results = await asyncio.gather(
+                *(elaborate(idx, name) for idx, name in enumerate(task_names, start=1)),
+                return_exceptions=True
+            )
+            for idx, (name, details) in enumerate(zip(task_names, results), start=1):
+                if isinstance(details, Exception) or not isinstance(details, dict):
+                    logger.error(f"Elaboration failed for '{name}': {details}")
                     # Reasonable fallback per-task to avoid identical outputs
                     default_phase = "Planning" if idx == 1 else "Implementation"
                     tasks.append(TaskBreakdown(
@@ -202,79 +359,95 @@ class LLMService:
                         phase=default_phase,
                         priority="medium",
                     ))
+                    continue
+                tasks.append(TaskBreakdown(
+                    task_name=name,
+                    description=details.get("description", f"Detailed work for {name}"),
+                    duration=details.get("duration", "2 days"),
+                    dependencies=details.get("dependencies", "None"),
+                    phase=details.get("phase", "Planning"),
+                    priority=details.get("priority", "medium"),
+                ))
             logger.info(f"✅ Generated and elaborated {len(tasks)} tasks (multi-model)")
             return tasks
 
         # Single-shot generation fallback using first available provider loop (original logic)
-        system_prompt = """You are an expert project manager and task planning AI. Your job is to break down user goals into actionable tasks with realistic timelines.
-
-IMPORTANT: You must respond with ONLY a valid JSON array. No other text, explanations, or markdown formatting.
-
-The JSON should contain an array of task objects, each with these exact fields:
-- task_name: string (concise task title)
-- description: string (detailed description of what needs to be done)
-- duration: string (e.g., "2 days", "1 week", "3 hours")
-- dependencies: string (what must be completed before this task, or "None")
-- phase: string (project phase: Planning, Research, Design, Implementation, Testing, Launch, or Maintenance)
-- priority: string ("high", "medium", or "low")
-
-Consider:
-- Logical task dependencies and sequencing
-- Realistic time estimates
-- Proper project phases
-- Risk mitigation and planning tasks
-- Testing and quality assurance
-- Documentation and handover"""
-
         user_prompt = f"""Break down this goal into 5-8 actionable tasks with dependencies and timelines:
 
 Goal: {user_goal}
 
 Respond with only the JSON array of tasks."""
 
-        for i, provider in enumerate(self.providers):
-            try:
-                logger.info(f"Attempting task generation with {provider['provider']} (attempt {i+1}/{len(self.providers)})")
-                content = await self._call_completion(
-                    provider,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=2000
-                )
-                logger.info(f"Raw response from {provider['provider']}: {content[:200]}...")
-                tasks_data = json.loads(content)
-                if not isinstance(tasks_data, list):
-                    raise ValueError("Response is not a JSON array")
-                tasks = []
-                for task_data in tasks_data:
-                    required_fields = ['task_name', 'description', 'duration', 'dependencies', 'phase', 'priority']
-                    if not all(field in task_data for field in required_fields):
-                        logger.warning(f"Task missing required fields: {task_data}")
-                        continue
-                    tasks.append(TaskBreakdown(
-                        task_name=task_data['task_name'],
-                        description=task_data['description'],
-                        duration=task_data['duration'],
-                        dependencies=task_data['dependencies'],
-                        phase=task_data['phase'],
-                        priority=task_data['priority']
-                    ))
-                logger.info(f"✅ Successfully generated {len(tasks)} tasks using {provider['provider']}")
+        if LLM_RACE_PROVIDERS and len(self.providers) > 1:
+            # Latency over cost: every provider gets the prompt and the first usable plan wins
+            tasks = await self._race_single_shot(user_prompt)
+            if tasks is not None:
                 return tasks
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parsing error with {provider['provider']}: {e}")
-                logger.error(f"Raw content: {content}")
-                continue
-            except Exception as e:
-                logger.error(f"Error with {provider['provider']}: {str(e)}")
-                continue
+        else:
+            for i, provider in enumerate(self.providers):
+                logger.info(f"Attempting task generation with {provider.provider} (attempt {i+1}/{len(self.providers)})")
+                try:
+                    return await self._single_shot(provider, user_prompt, progress_cb)
+                except Exception:
+                    continue
 
         logger.warning("All LLM providers failed, using fallback task generation")
-        return self._get_fallback_tasks(user_goal)
-    
+        return None
+
+    async def _single_shot(self, provider: LLMProvider, user_prompt: str, progress_cb: Optional[ProgressCallback] = None) -> List[TaskBreakdown]:
+        """Generate the whole plan in one call; logs and re-raises on failure."""
+        content = ""
+        try:
+            content = await self._call_completion(
+                provider,
+                messages=[
+                    self._system_message(provider, FALLBACK_SYSTEM_PROMPT),
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=0.7,
+                max_tokens=2000,
+                stream=progress_cb is not None,
+                progress_cb=progress_cb
+            )
+            logger.info(f"Raw response from {provider.provider}: {content[:200]}...")
+            tasks_data = orjson.loads(content)
+            if not isinstance(tasks_data, list):
+                raise ValueError("Response is not a JSON array")
+        except orjson.JSONDecodeError as e:
+            logger.error(f"JSON parsing error with {provider.provider}: {e}")
+            logger.error(f"Raw content: {content}")
+            raise
+        except Exception as e:
+            logger.error(f"Error with {provider.provider}: {str(e)}")
+            raise
+        tasks = [
+            TaskBreakdown(**{field: task_data[field] for field in TASK_FIELDS})
+            for task_data in tasks_data
+            if isinstance(task_data, dict) and TASK_FIELDS <= task_data.keys()
+        ]
+        skipped = len(tasks_data) - len(tasks)
+        if skipped:
+            logger.warning(f"Skipped {skipped} task(s) missing required fields")
+        logger.info(f"✅ Successfully generated {len(tasks)} tasks using {provider.provider}")
+        return tasks
+
+    async def _race_single_shot(self, user_prompt: str) -> Optional[List[TaskBreakdown]]:
+        """Send the single-shot prompt to all providers concurrently; return the first success
+        and cancel the rest. Not streamed, since partial text from several models would interleave."""
+        logger.info(f"Racing task generation across {len(self.providers)} providers")
+        pending = [asyncio.create_task(self._single_shot(provider, user_prompt)) for provider in self.providers]
+        try:
+            for next_done in asyncio.as_completed(pending):
+                try:
+                    return await next_done
+                except Exception:
+                    # Already logged by _single_shot; wait for the next provider
+                    continue
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
     def _get_fallback_tasks(self, user_goal: str) -> List[TaskBreakdown]:
         """Fallback task generation when all LLM providers fail"""
         return [
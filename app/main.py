@@ -1,28 +1,100 @@
-from fastapi import FastAPI, Request, Depends, Form, HTTPException, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, Request, Depends, Form, HTTPException, Response, status
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlmodel import Session, select
+from jinja2 import FileSystemBytecodeCache
+from celery import states
+import orjson
+import redis.asyncio as aioredis
+from sqlalchemy import and_, case, exists, func, insert, literal, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Optional
-from datetime import timedelta
-from .database import create_db_and_tables, engine
-from .models import User
+from datetime import datetime, timedelta
+from .database import (
+    dispose_async_engine, dispose_engine, get_async_session, init_db_with_retry
+)
+from .celery_config import celery_app, task_owner_key
+from .models import Plan, Task, TaskProgress, TaskStatus, User
+from .llm_service import llm_service
 from .security import (
-    get_password_hash, create_access_token, verify_password, 
-    get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
+    get_password_hash, create_access_token, verify_and_update_password,
+    run_password_hashing, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
 )
 import os
+import asyncio
+import hashlib
+import logging
+import signal
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="Smart Task Planner")
-templates = Jinja2Templates(directory="templates")
+app = FastAPI(title="Smart Task Planner", default_response_class=ORJSONResponse)
+logger = logging.getLogger(__name__)
+
+# "inline" generates plans inside the request; "celery" queues them on the worker
+PLAN_GENERATION_BACKEND = os.getenv("PLAN_GENERATION_BACKEND", "inline").lower()
+# Longest an SSE task stream stays open before telling the page to give up
+TASK_STREAM_TIMEOUT = float(os.getenv("TASK_STREAM_TIMEOUT", "300"))
+
+# Compiled template bytecode survives restarts and is shared by workers. The default directory
+# is per-user with mode 0700 and ownership-checked by Jinja; the cache is marshal-loaded,
+# so it must never live somewhere other local users can write.
+templates = Jinja2Templates(directory="templates", bytecode_cache=FileSystemBytecodeCache())
+# Skip per-render mtime checks unless explicitly developing against live template edits
+templates.env.auto_reload = os.getenv("TEMPLATES_AUTO_RELOAD", "false").lower() == "true"
+
+# Compiled Template handles, filled once at startup: name -> Template
+TEMPLATE_CACHE = {}
+
+def _preload_templates():
+    for name in templates.env.list_templates():
+        TEMPLATE_CACHE[name] = templates.env.get_template(name)
+
+# Pages whose output never depends on the request, rendered once: name -> (body, etag)
+STATIC_PAGES = ("login.html", "signup.html")
+_static_pages = {}
+
+def _render_static_page(name: str):
+    page = _static_pages.get(name)
+    if page is None:
+        body = TEMPLATE_CACHE[name].render().encode()
+        page = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        _static_pages[name] = page
+    return page
+
+def _static_page_response(request: Request, name: str) -> Response:
+    body, etag = _render_static_page(name)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=3600"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="text/html", headers=headers)
+
+# Async client on the Celery result backend, used to follow task state over pub/sub
+result_redis = aioredis.Redis.from_url(celery_app.conf.result_backend)
+
+def _exit_if_db_init_failed(task: asyncio.Task):
+    # Without a schema every DB-backed request would just 503; shut down so the
+    # process manager restarts us, as a failed blocking startup used to
+    if task.cancelled() or task.exception() is None:
+        return
+    logger.critical(f"Database initialisation failed, shutting down: {task.exception()}")
+    os.kill(os.getpid(), signal.SIGTERM)
 
 @app.on_event("startup")
-def on_startup():
-    # Retry DB init on cold starts or transient network issues
-    create_db_and_tables(retries=5, delay=2.0)
+async def on_startup():
+    # Retry DB init on cold starts or transient network issues without delaying port binding
+    app.state.db_init_task = asyncio.create_task(init_db_with_retry(retries=5, delay=2.0))
+    app.state.db_init_task.add_done_callback(_exit_if_db_init_failed)
+    _preload_templates()
+    for name in STATIC_PAGES:
+        _render_static_page(name)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    dispose_engine()
+    await dispose_async_engine()
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request, current_user: Optional[User] = Depends(get_current_user)):
@@ -33,40 +105,50 @@ async def read_root(request: Request, current_user: Optional[User] = Depends(get
 
 @app.get("/signup", response_class=HTMLResponse)
 def get_signup_form(request: Request):
-    return templates.TemplateResponse("signup.html", {"request": request})
+    return _static_page_response(request, "signup.html")
 
 @app.post("/signup", response_class=HTMLResponse)
-def handle_signup(request: Request, email: str = Form(...), password: str = Form(...)):
-    with Session(engine) as session:
-        existing_user = session.exec(select(User).where(User.email == email)).first()
-        if existing_user:
-            return templates.TemplateResponse("signup.html", {"request": request, "error": "Email already registered"})
-        
-        hashed_password = get_password_hash(password)
-        new_user = User(email=email, hashed_password=hashed_password)
-        session.add(new_user)
-        session.commit()
+async def handle_signup(request: Request, email: str = Form(...), password: str = Form(...), session: AsyncSession = Depends(get_async_session)):
+    email = email.strip().lower()
+    # EXISTS lets the database stop at the first index hit without returning a row
+    email_taken = await session.scalar(select(exists().where(User.email == email)))
+    if email_taken:
+        return templates.TemplateResponse("signup.html", {"request": request, "error": "Email already registered"})
+    
+    hashed_password = await run_password_hashing(get_password_hash, password)
+    new_user = User(email=email, hashed_password=hashed_password)
+    session.add(new_user)
+    await session.commit()
     return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
 
 @app.get("/login", response_class=HTMLResponse)
 def get_login_form(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return _static_page_response(request, "login.html")
 
 @app.post("/login")
-async def handle_login(request: Request, username: str = Form(...), password: str = Form(...)):
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.email == username)).first()
-        if not user or not verify_password(password, user.hashed_password):
-            return templates.TemplateResponse("login.html", {"request": request, "error": "Incorrect email or password"}, status_code=status.HTTP_401_UNAUTHORIZED)
-        
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
-        )
-        
-        response = RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
-        response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True)
-        return response
+async def handle_login(request: Request, username: str = Form(...), password: str = Form(...), session: AsyncSession = Depends(get_async_session)):
+    # Only the columns needed to authenticate, answered via the unique email index
+    user = (await session.exec(
+        select(User.email, User.hashed_password).where(User.email == username.strip().lower())
+    )).first()
+    if not user:
+        return templates.TemplateResponse("login.html", {"request": request, "error": "Incorrect email or password"}, status_code=status.HTTP_401_UNAUTHORIZED)
+    verified, new_hash = await run_password_hashing(verify_and_update_password, password, user.hashed_password)
+    if not verified:
+        return templates.TemplateResponse("login.html", {"request": request, "error": "Incorrect email or password"}, status_code=status.HTTP_401_UNAUTHORIZED)
+    if new_hash:
+        # Migrate legacy bcrypt hashes to argon2 transparently
+        await session.execute(update(User).where(User.email == user.email).values(hashed_password=new_hash))
+        await session.commit()
+    
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user.email}, expires_delta=access_token_expires
+    )
+    
+    response = RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
+    response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True)
+    return response
 
 @app.get("/logout")
 def logout():
@@ -80,52 +162,91 @@ def tasks_redirect():
 
 
 @app.get("/profile", response_class=HTMLResponse)
-async def view_profile(request: Request, current_user: Optional[User] = Depends(get_current_user)):
+async def view_profile(request: Request, current_user: Optional[User] = Depends(get_current_user), session: AsyncSession = Depends(get_async_session)):
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_302_FOUND)
-    from .models import Plan, Task, TaskProgress
-    with Session(engine) as session:
-        # Get all plans for the current user ordered by creation date
-        user_plans = session.exec(
-            select(Plan)
-            .where(Plan.owner_id == current_user.id)
-            .order_by(Plan.created_at.desc())
-        ).all()
-        
-        # Get all tasks for tracking with their progress
-        all_user_tasks = []
-        for plan in user_plans:
-            for task in plan.tasks:
-                # Get latest progress for each task
-                latest_progress = session.exec(
-                    select(TaskProgress)
-                    .where(TaskProgress.task_id == task.id)
-                    .order_by(TaskProgress.timestamp.desc())
-                ).first()
-                all_user_tasks.append({
-                    'task': task,
-                    'plan': plan,
-                    'latest_progress': latest_progress
-                })
-        
+    # Cheap aggregate over the user's plans/tasks; unchanged data means the browser's copy is current
+    summary = (await session.exec(
+        select(func.count(func.distinct(Plan.id)), func.max(Plan.created_at), func.count(Task.id), func.max(Task.updated_at))
+        .select_from(Plan)
+        .outerjoin(Task, Task.plan_id == Plan.id)
+        .where(Plan.owner_id == current_user.id)
+    )).one()
+    etag = f'"{hashlib.sha256(repr((current_user.id, current_user.email, *summary)).encode()).hexdigest()[:32]}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+
+    # Get all plans for the current user ordered by creation date, fetching only the
+    # columns the template renders rather than full ORM entities
+    plan_rows = (await session.execute(
+        select(Plan.id, Plan.user_goal, Plan.created_at)
+        .where(Plan.owner_id == current_user.id)
+        .order_by(Plan.created_at.desc())
+    )).all()
+    user_plans = [{**row._mapping, 'tasks': []} for row in plan_rows]
+    plans_by_id = {plan['id']: plan for plan in user_plans}
+
+    task_ids = []
+    if plans_by_id:
+        task_rows = (await session.execute(
+            select(
+                Task.id, Task.plan_id, Task.taskName, Task.description,
+                Task.duration, Task.phase, Task.priority, Task.status,
+            )
+            .where(Task.plan_id.in_(list(plans_by_id)))
+            .order_by(Task.id)
+        )).all()
+        for row in task_rows:
+            plans_by_id[row.plan_id]['tasks'].append(dict(row._mapping))
+            task_ids.append(row.id)
+
+    # Latest progress entry per task in a single grouped query instead of one per task
+    latest_by_task = {}
+    if task_ids:
+        latest = (
+            select(TaskProgress.task_id, func.max(TaskProgress.timestamp).label("ts"))
+            .where(TaskProgress.task_id.in_(task_ids))
+            .group_by(TaskProgress.task_id)
+            .subquery()
+        )
+        progress_rows = (await session.exec(
+            select(TaskProgress).join(
+                latest,
+                and_(TaskProgress.task_id == latest.c.task_id, TaskProgress.timestamp == latest.c.ts)
+            )
+        )).all()
+        latest_by_task = {progress.task_id: progress for progress in progress_rows}
+
+    # Get all tasks for tracking with their progress
+    all_user_tasks = [
+        {
+            'task': task,
+            'plan': plan,
+            'latest_progress': latest_by_task.get(task['id'])
+        }
+        for plan in user_plans
+        for task in plan['tasks']
+    ]
+    
     return templates.TemplateResponse("profile.html", {
         "request": request, 
         "user": current_user, 
         "plans": user_plans,
         "task_progress": all_user_tasks
-    })
+    }, headers=cache_headers)
 
 @app.post("/api/generate-plan")
-async def post_generate_plan(request: Request, goal: str = Form(...), current_user: User = Depends(get_current_user)):
+async def post_generate_plan(request: Request, goal: str = Form(...), current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_async_session)):
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    from .models import Plan, Task, TaskStatus
-    from .llm_service import llm_service
-    import logging
-    from fastapi.responses import HTMLResponse
-    
-    logger = logging.getLogger(__name__)
+    if PLAN_GENERATION_BACKEND == "celery":
+        # Hand the LLM round-trips and DB writes to the worker; the fragment follows progress over SSE
+        from .tasks import enqueue_plan_generation
+        job = await asyncio.to_thread(enqueue_plan_generation, goal, None, current_user.id)
+        logger.info(f"Queued plan generation {job.id} for goal: {goal[:100]}...")
+        return templates.TemplateResponse("polling.html", {"request": request, "task_id": job.id, "status": "PENDING"})
     
     try:
         logger.info(f"Generating plan for goal: {goal[:100]}...")
@@ -134,39 +255,39 @@ async def post_generate_plan(request: Request, goal: str = Form(...), current_us
         task_breakdowns = await llm_service.generate_tasks(goal)
         
         # Save to database
-        with Session(engine) as session:
-            # Create new plan (don't check for existing to allow multiple plans)
-            new_plan = Plan(user_goal=goal, owner_id=current_user.id)
-            session.add(new_plan)
-            session.commit()
-            session.refresh(new_plan)
-            
-            plan_tasks = []
-            for breakdown in task_breakdowns:
-                new_task = Task(
-                    taskName=breakdown.task_name,
-                    description=breakdown.description,
-                    duration=breakdown.duration,
-                    dependencies=breakdown.dependencies,
-                    phase=breakdown.phase,
-                    priority=breakdown.priority,
-                    status=TaskStatus.REJECTED,  # Start as not submitted
-                    plan_id=new_plan.id
-                )
-                session.add(new_task)
-                plan_tasks.append(new_task)
-            
-            session.commit()
-            
-            # Refresh tasks to ensure they have IDs
-            for task in plan_tasks:
-                session.refresh(task)
-            
-            logger.info(f"✅ Created plan with {len(plan_tasks)} tasks")
-            plan_data = {"tasks": plan_tasks}
+        # Create new plan (don't check for existing to allow multiple plans)
+        new_plan = Plan(user_goal=goal, owner_id=current_user.id)
+        session.add(new_plan)
+        # Flush assigns the plan id without ending the transaction
+        await session.flush()
+        
+        # One multi-row INSERT for all tasks; the fragment renders from these rows,
+        # so nothing needs to be re-selected afterwards
+        now = datetime.utcnow()
+        plan_tasks = [
+            {
+                "taskName": breakdown.task_name,
+                "description": breakdown.description,
+                "duration": breakdown.duration,
+                "dependencies": breakdown.dependencies,
+                "phase": breakdown.phase,
+                "priority": breakdown.priority,
+                "status": TaskStatus.REJECTED,  # Start as not submitted
+                "created_at": now,
+                "updated_at": now,
+                "plan_id": new_plan.id,
+            }
+            for breakdown in task_breakdowns
+        ]
+        if plan_tasks:
+            await (await session.connection()).execute(insert(Task).values(plan_tasks))
+        await session.commit()
+        
+        logger.info(f"✅ Created plan with {len(plan_tasks)} tasks")
+        plan_data = {"tasks": plan_tasks}
 
         # Render the result fragment first, then auto-redirect to profile after a short delay
-        html_fragment = templates.get_template("result.html").render({
+        html_fragment = TEMPLATE_CACHE["result.html"].render({
             "request": request,
             "plan": plan_data
         })
@@ -181,44 +302,125 @@ async def post_generate_plan(request: Request, goal: str = Form(...), current_us
         logger.error(f"Error generating plan: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate plan: {str(e)}")
 
+async def _toggle_task_status(session: AsyncSession, task_id: int, owner_id: int, current: TaskStatus, toggled: TaskStatus, default: TaskStatus):
+    """Flip a task's status in one UPDATE ... RETURNING, scoped to tasks the user owns."""
+    # Bind both branches with the column's enum type; untyped parameters make Postgres type the CASE as text
+    status_type = Task.__table__.c.status.type
+    stmt = (
+        update(Task)
+        .where(
+            Task.id == task_id,
+            Task.plan_id.in_(select(Plan.id).where(Plan.owner_id == owner_id))
+        )
+        .values(
+            status=case(
+                (Task.status == current, literal(toggled, status_type)),
+                else_=literal(default, status_type)
+            ),
+            updated_at=datetime.utcnow()
+        )
+        .returning(Task.status)
+    )
+    # Core execution on the connection skips ORM hydration and the identity map
+    connection = await session.connection()
+    new_status = (await connection.execute(stmt)).scalar_one_or_none()
+    if new_status is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    await session.commit()
+    return new_status
+
 @app.post("/api/toggle-task/{task_id}")
-async def toggle_task_completion(task_id: int, current_user: User = Depends(get_current_user)):
+async def toggle_task_completion(task_id: int, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_async_session)):
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    from .models import Task
-    with Session(engine) as session:
-        task = session.exec(select(Task).where(Task.id == task_id)).first()
-        if not task:
-            raise HTTPException(status_code=404, detail="Task not found")
-        
-        from .models import TaskStatus
-        # Toggle between SUBMITTED and COMPLETED
-        if task.status == TaskStatus.COMPLETED:
-            task.status = TaskStatus.SUBMITTED
-        else:
-            task.status = TaskStatus.COMPLETED
-        
-        session.commit()
-        return {"status": "success", "new_status": task.status}
+    # Toggle between SUBMITTED and COMPLETED
+    new_status = await _toggle_task_status(session, task_id, current_user.id, TaskStatus.COMPLETED, TaskStatus.SUBMITTED, TaskStatus.COMPLETED)
+    return {"status": "success", "new_status": new_status}
 
 @app.post("/api/submit-task/{task_id}")
-async def toggle_task_submission(task_id: int, current_user: User = Depends(get_current_user)):
+async def toggle_task_submission(task_id: int, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_async_session)):
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    from .models import Task
-    with Session(engine) as session:
-        task = session.exec(select(Task).where(Task.id == task_id)).first()
-        if not task:
-            raise HTTPException(status_code=404, detail="Task not found")
-        
-        from .models import TaskStatus
-        # Toggle between REJECTED (not submitted) and SUBMITTED (submitted for review)
-        if task.status == TaskStatus.SUBMITTED:
-            task.status = TaskStatus.REJECTED  # Unsubmit
-        else:
-            task.status = TaskStatus.SUBMITTED  # Submit
-        
-        session.commit()
-        return {"status": "success", "new_status": task.status}
+    # Toggle between REJECTED (not submitted) and SUBMITTED (submitted for review)
+    new_status = await _toggle_task_status(session, task_id, current_user.id, TaskStatus.SUBMITTED, TaskStatus.REJECTED, TaskStatus.SUBMITTED)
+    return {"status": "success", "new_status": new_status}
+
+def _sse_frame(event: str, data: str) -> str:
+    # Multi-line payloads need one "data:" field per line
+    lines = "".join(f"data: {line}\n" for line in data.splitlines() or [""])
+    return f"event: {event}\n{lines}\n"
+
+def _render_task_result(meta: dict) -> str:
+    if meta["status"] == states.SUCCESS:
+        plan = (meta.get("result") or {}).get("plan", {})
+    else:
+        plan = {"error": str(meta.get("result") or "Plan generation failed")}
+    return TEMPLATE_CACHE["result.html"].render({"plan": plan})
+
+async def _require_task_owner(task_id: str, user: User):
+    owner_id = await result_redis.get(task_owner_key(task_id))
+    # Unknown and foreign ids look the same, so task ids can't be probed
+    if owner_id is None or int(owner_id) != user.id:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+async def _task_event_stream(task_id: str):
+    backend = celery_app.backend
+    deadline = asyncio.get_running_loop().time() + TASK_STREAM_TIMEOUT
+    channel = backend.get_key_for_task(task_id)
+    pubsub = result_redis.pubsub()
+    # The Redis result backend publishes every state change on the task's meta key
+    await pubsub.subscribe(channel)
+    try:
+        # Read the current state once in case the task finished before we subscribed
+        raw = await result_redis.get(channel)
+        meta = backend.decode_result(raw) if raw else {"status": states.PENDING}
+        while True:
+            if meta["status"] in states.READY_STATES:
+                yield _sse_frame("done", _render_task_result(meta))
+                return
+            event = {"status": meta["status"]}
+            if meta["status"] == "PROGRESS":
+                event["partial"] = (meta.get("result") or {}).get("partial", "")
+            yield _sse_frame("status", orjson.dumps(event).decode())
+            message = None
+            while message is None or message["type"] != "message":
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    # Bounded wait: a stuck or lost task must not hold the connection open forever
+                    yield _sse_frame("timeout", orjson.dumps({"status": meta["status"]}).decode())
+                    return
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=min(15.0, remaining))
+                if message is None:
+                    # Comment frame keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+            meta = backend.decode_result(message["data"])
+    finally:
+        await pubsub.unsubscribe(channel)
+        await pubsub.close()
+
+@app.get("/api/task-stream/{task_id}")
+async def stream_task_status(task_id: str, current_user: User = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    await _require_task_owner(task_id, current_user)
+    return StreamingResponse(
+        _task_event_stream(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/task-status/{task_id}")
+async def get_task_status(task_id: str, current_user: User = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    await _require_task_owner(task_id, current_user)
+    # get_task_meta reads state and result together: one backend GET per poll
+    meta = await asyncio.to_thread(celery_app.backend.get_task_meta, task_id)
+    state, result = meta["status"], meta.get("result")
+    if state == states.FAILURE:
+        result = str(result)
+    elif state != states.SUCCESS:
+        result = None
+    return {"task_id": task_id, "status": state, "result": result}
@@ -1,4 +1,5 @@
 from typing import List, Optional
+from sqlalchemy import Index, text
 from sqlmodel import Field, SQLModel, Relationship
 from datetime import datetime
 from enum import Enum
@@ -16,6 +17,8 @@ class PlanRequest(SQLModel):
     goal: str
 
 class Task(SQLModel, table=True):
+    __table_args__ = (Index("ix_task_plan", "plan_id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     taskName: str
     description: str
@@ -33,6 +36,8 @@ class Task(SQLModel, table=True):
     progress_history: List["TaskProgress"] = Relationship(back_populates="task")
 
 class Plan(SQLModel, table=True):
+    __table_args__ = (Index("ix_plan_owner_created", "owner_id", text("created_at DESC")),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_goal: str
     created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
@@ -46,6 +51,8 @@ class PlanResponse(SQLModel):
     plan: List[Task]
 
 class TaskProgress(SQLModel, table=True):
+    __table_args__ = (Index("ix_progress_task_ts", "task_id", text("timestamp DESC")),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     status: TaskStatus
     comment: Optional[str] = None
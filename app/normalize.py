@@ -0,0 +1,9 @@
+import unicodedata
+
+def normalize_goal(goal: str) -> str:
+    """Canonical form of a goal for cache keys: NFKC, invisible format characters dropped,
+    whitespace collapsed, lowercased. Storage and prompts keep the user's original text."""
+    goal = unicodedata.normalize("NFKC", goal)
+    # NFKC leaves zero-width spaces and joiners (category Cf) in place
+    goal = "".join(ch for ch in goal if unicodedata.category(ch) != "Cf")
+    return " ".join(goal.split()).lower()
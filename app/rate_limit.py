@@ -0,0 +1,68 @@
+import os
+import hashlib
+from functools import lru_cache
+
+# Token bucket kept in Redis so every worker sharing an API key paces against the same budget.
+# Callers always reserve: the balance may go negative and the script returns how long the
+# caller must wait for its reservation to be covered, so no one polls or retries.
+# KEYS: per bucket a (tokens, timestamp) pair. ARGV: per bucket (capacity, refill per ms, cost).
+_TOKEN_BUCKET_LUA = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local wait_ms = 0
+for i = 1, #KEYS / 2 do
+    local tokens_key, ts_key = KEYS[2 * i - 1], KEYS[2 * i]
+    local capacity = tonumber(ARGV[3 * i - 2])
+    local rate = tonumber(ARGV[3 * i - 1])
+    local cost = tonumber(ARGV[3 * i])
+    local tokens = tonumber(redis.call('GET', tokens_key) or capacity)
+    local last = tonumber(redis.call('GET', ts_key) or now_ms)
+    tokens = math.min(capacity, tokens + (now_ms - last) * rate) - cost
+    local ttl = math.ceil(capacity / rate)
+    redis.call('SET', tokens_key, tokens, 'PX', ttl)
+    redis.call('SET', ts_key, now_ms, 'PX', ttl)
+    if tokens < 0 then
+        wait_ms = math.max(wait_ms, math.ceil(-tokens / rate))
+    end
+end
+return wait_ms
+"""
+
+# OpenAI tier-1 defaults; set to your account's limits
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "3500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "60000"))
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    # Optional and loaded on first use: building the BPE tables is slow and may hit the network
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception:
+        return None
+
+def estimate_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+_scripts = {}
+
+def acquire(client, api_key: str, tokens: int) -> float:
+    """Reserve one request and `tokens` tokens for this key; returns seconds to wait first."""
+    script = _scripts.get(id(client))
+    if script is None:
+        script = _scripts[id(client)] = client.register_script(_TOKEN_BUCKET_LUA)
+    # Hash the key so the secret itself never lands in Redis
+    key_id = hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest()
+    keys = [
+        f"ratelimit:{key_id}:rpm:tokens", f"ratelimit:{key_id}:rpm:ts",
+        f"ratelimit:{key_id}:tpm:tokens", f"ratelimit:{key_id}:tpm:ts",
+    ]
+    args = [
+        OPENAI_RPM, OPENAI_RPM / 60000, 1,
+        OPENAI_TPM, OPENAI_TPM / 60000, tokens,
+    ]
+    return int(script(keys=keys, args=args)) / 1000
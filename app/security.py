@@ -1,24 +1,104 @@
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-from passlib.context import CryptContext
+from cachetools import TTLCache
+from dotenv import load_dotenv
+import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHash, VerificationError
 from jose import JWTError, jwt
 from fastapi import Depends, Request
-from sqlmodel import Session, select
-from .database import engine
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .database import get_async_engine, wait_for_db
 from .models import User
 
-SECRET_KEY = os.urandom(32).hex()
+load_dotenv()
+
+# Sample values from docs and tutorials; signing with one of these lets anyone forge a session
+_PLACEHOLDER_SECRETS = frozenset(("change-me", "changeme", "secret", "your-secret-key", "jwt-secret"))
+
+def _load_secret_key() -> str:
+    """Signing key from JWT_SECRET, else a key persisted to JWT_SECRET_FILE on first start."""
+    secret = os.getenv("JWT_SECRET")
+    if secret:
+        if secret.strip().lower() in _PLACEHOLDER_SECRETS:
+            raise RuntimeError("JWT_SECRET is a placeholder value; set a random secret or leave it unset")
+        return secret
+    path = os.getenv("JWT_SECRET_FILE", ".jwt_secret")
+    try:
+        with open(path) as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+    except FileNotFoundError:
+        pass
+    # Write the full key to a private temp file, then hard-link it into place: the link either
+    # publishes a complete file or fails because another worker already published theirs
+    candidate = os.urandom(32).hex()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(candidate)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp_path, path)
+            return candidate
+        except FileExistsError:
+            with open(path) as f:
+                secret = f.read().strip()
+            if not secret:
+                raise RuntimeError(f"JWT secret file {path} is empty; set JWT_SECRET or remove the file")
+            return secret
+    finally:
+        os.unlink(tmp_path)
+
+SECRET_KEY = _load_secret_key()
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Users already resolved from a verified token, keyed by (email, token signature).
+# The JWT itself is still decoded and checked for expiry on every request.
+_user_cache = TTLCache(maxsize=10_000, ttl=int(os.getenv("AUTH_USER_CACHE_TTL", "60")))
+
+# New hashes use argon2id; existing bcrypt hashes still verify and are upgraded on login
+_argon2 = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1)
+
+# Dedicated pool so hashing bursts can't starve FastAPI's shared threadpool
+_PW_POOL = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="pwhash")
+
+def _is_argon2_hash(hashed_password: str) -> bool:
+    return hashed_password.startswith("$argon2")
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    if _is_argon2_hash(hashed_password):
+        try:
+            return _argon2.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHash):
+            return False
+    try:
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+    except ValueError:
+        return False
+
+def verify_and_update_password(plain_password, hashed_password):
+    """Return (verified, new_hash); new_hash is set when the stored hash should be upgraded."""
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    if not _is_argon2_hash(hashed_password) or _argon2.check_needs_rehash(hashed_password):
+        return True, get_password_hash(plain_password)
+    return True, None
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return _argon2.hash(password)
+
+async def run_password_hashing(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_PW_POOL, func, *args)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -44,7 +124,16 @@ async def get_current_user(request: Request) -> Optional[User]:
     except (JWTError, IndexError):
         return None
     
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.email == email)).first()
+    cache_key = (email, token.rsplit(".", 1)[-1])
+    user = _user_cache.get(cache_key)
+    if user is not None:
+        return user
+    
+    await wait_for_db()
+    # Runs on every page load, so await the lookup rather than blocking the event loop
+    async with AsyncSession(get_async_engine()) as session:
+        user = await session.scalar(select(User).where(User.email == email))
     
+    if user is not None:
+        _user_cache[cache_key] = user
     return user
\ No newline at end of file
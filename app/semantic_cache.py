@@ -0,0 +1,103 @@
+import os
+import uuid
+import logging
+from functools import lru_cache
+from typing import Optional
+from dotenv import load_dotenv
+from redis.commands.search.field import VectorField
+from redis.commands.search.query import Query
+from redis.exceptions import RedisError, ResponseError
+try:
+    from redis.commands.search.index_definition import IndexDefinition, IndexType
+except ImportError:  # redis-py < 6
+    from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "false").lower() == "true"
+EMBEDDING_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_DIM = 384
+# Max cosine distance for a paraphrase to count as the same goal
+DISTANCE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.12"))
+INDEX_NAME = "plan_idx"
+KEY_PREFIX = "plansem:"
+
+@lru_cache
+def _get_model():
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    # Optional: needs sentence-transformers installed and a Redis server with RediSearch (Redis Stack).
+    # Imported on first use since it pulls in torch, which would otherwise load in every worker.
+    try:
+        from sentence_transformers import SentenceTransformer
+    except Exception:
+        return None
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+_index_ready = False
+
+def _ensure_index(client):
+    global _index_ready
+    if _index_ready:
+        return
+    try:
+        client.ft(INDEX_NAME).create_index(
+            # The plan is stored on the hash but left out of the schema so it isn't indexed
+            [VectorField("embedding", "HNSW", {
+                "TYPE": "FLOAT32", "DIM": EMBEDDING_DIM, "DISTANCE_METRIC": "COSINE",
+            })],
+            definition=IndexDefinition(prefix=[KEY_PREFIX], index_type=IndexType.HASH),
+        )
+    except ResponseError as e:
+        if "already exists" not in str(e).lower():
+            raise
+    _index_ready = True
+
+def embed(goal: str) -> Optional[bytes]:
+    """Normalized embedding of the goal as FLOAT32 bytes, or None when the cache is disabled."""
+    model = _get_model()
+    if model is None:
+        return None
+    try:
+        vector = model.encode(goal.strip(), normalize_embeddings=True)
+        return vector.astype("float32").tobytes()
+    except Exception as e:
+        logger.warning(f"Semantic cache embedding failed: {e}")
+        return None
+
+def lookup(client, embedding: Optional[bytes]):
+    """Return the cached plan bytes of the nearest stored goal within the threshold, if any."""
+    if embedding is None:
+        return None
+    try:
+        _ensure_index(client)
+        # Field is not named "payload": redis-py's Document reserves that keyword.
+        # The plan is msgpack, so it must come back as raw bytes rather than decoded text.
+        query = (
+            Query("*=>[KNN 1 @embedding $vec AS distance]")
+            .return_field("plan", decode_field=False)
+            .return_field("distance")
+            .dialect(2)
+        )
+        docs = client.ft(INDEX_NAME).search(query, query_params={"vec": embedding}).docs
+    except RedisError as e:
+        # Like the exact-match cache, a semantic cache outage only costs an LLM call
+        logger.warning(f"Semantic cache lookup failed: {e}")
+        return None
+    if docs and float(docs[0].distance) <= DISTANCE_THRESHOLD:
+        return getattr(docs[0], "plan", None)
+    return None
+
+def store(client, embedding: Optional[bytes], payload: bytes, ttl: int = 3600):
+    if embedding is None:
+        return
+    try:
+        _ensure_index(client)
+        key = f"{KEY_PREFIX}{uuid.uuid4().hex}"
+        with client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={"embedding": embedding, "plan": payload})
+            pipe.expire(key, ttl)
+            pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Semantic cache write failed: {e}")
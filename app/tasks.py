@@ -1,75 +1,324 @@
 import os
-import json
+import re
+import time
+import hashlib
+import msgpack
+import orjson
 import redis
 import uuid
 import datetime
+import threading
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+import httpx
 from dotenv import load_dotenv
-from sqlmodel import Session, select
-from .celery_config import celery_app
-from .models import Plan, Task
-from .database import engine
-
-# OpenAI import
-try:
-    import openai
-except Exception:
-    openai = None
+from celery.signals import worker_init, worker_process_init
+from sqlalchemy import String, bindparam, cast, func, insert, literal, select, true
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlmodel import Session
+from .celery_config import celery_app, task_owner_key
+from .models import Plan, Task, TaskStatus
+from .database import dispose_engine, get_engine
+from . import rate_limit, semantic_cache
+from .backoff import retry_delay
+from .normalize import normalize_goal
 
 load_dotenv()
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+def _redis_pool():
+    # Raw bytes: cached plans are msgpack, so decoding replies to str would be wasted work (and lossy).
+    # Health checks catch connections dropped while idle; a local unix socket skips the TCP stack.
+    # Blocking pool: at the limit a greenlet waits for a free connection instead of raising.
+    # Each task can hold one for commands plus one for a single-flight pub/sub wait, so size it
+    # to at least twice the worker concurrency.
+    options = dict(
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "200")),
+        timeout=float(os.getenv("REDIS_POOL_TIMEOUT", "5")),
+        health_check_interval=30,
+        decode_responses=False,
+    )
+    socket_path = os.getenv("REDIS_SOCKET")
+    if socket_path:
+        return redis.BlockingConnectionPool(
+            connection_class=redis.UnixDomainSocketConnection, path=socket_path, db=0, **options
+        )
+    return redis.BlockingConnectionPool.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), **options)
+
+redis_client = redis.Redis(connection_pool=_redis_pool())
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
-if openai and OPENAI_KEY:
-    openai.api_key = OPENAI_KEY
+PLAN_LOCK_PENDING_TTL = 300
+PLAN_LOCK_TTL = 3600
+PLAN_LOCK_SAVED = "saved"
+# Flight lock lease; the leader keeps renewing it while it generates
+PLAN_FLIGHT_TTL = 60
+# Longest a single plan generation may take (rate-limit waits, 429 backoff and the model call);
+# bounds both the pending owner lock and how long waiters follow a live leader
+PLAN_GENERATION_TIMEOUT = PLAN_LOCK_PENDING_TTL
+_REFRESH_FLIGHT_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_refresh_flight = redis_client.register_script(_REFRESH_FLIGHT_LUA)
+# Outermost {...} in model output that wraps its JSON in prose
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+@lru_cache
+def _get_openai():
+    # The SDK is imported on first model call rather than at worker boot, so forks and
+    # max_tasks_per_child recycles don't each pay for it up front
+    try:
+        import openai
+    except Exception:
+        return None
+    return openai
+
+@lru_cache
+def _get_openai_client():
+    # Built on first use so each forked worker gets its own pool; one HTTP/2 connection carries
+    # concurrent streams and keeps TLS warm across tasks. SDK retries are off because the
+    # rate limiter and backoff below already own 429 handling.
+    return _get_openai().OpenAI(
+        api_key=OPENAI_KEY,
+        max_retries=0,
+        http_client=httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            timeout=30.0,
+        ),
+    )
+
+# The fixed instructions go in the system message so repeated calls share a cacheable prefix
+PLANNER_SYSTEM_PROMPT = (
+    "You are an expert project planner. Given a short user goal, break it into an ordered list of tasks. "
+    "Return JSON: {title, generated_by, tasks:[{id,title,duration_days,dependencies,priority,notes}], created_at}. "
+    "Return only JSON."
+)
+_PLANNER_USER_PROMPT = "Goal: {goal}\nDeadline: {deadline}".format
+
+@worker_process_init.connect
+def _reset_engine_after_fork(**kwargs):
+    # Pooled connections inherited from the parent must not be shared across forks
+    dispose_engine(close=False)
+
+@worker_init.connect
+def _make_psycopg2_green(**kwargs):
+    # Under -P gevent, sockets are monkey-patched but psycopg2's C driver still blocks the hub;
+    # psycogreen makes its waits cooperative so one process can run many LLM-bound tasks
+    try:
+        from gevent import monkey
+    except ImportError:
+        return
+    if not monkey.is_module_patched("socket"):
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        return
+    patch_psycopg()
 
 @celery_app.task(bind=True)
 def generate_plan_task(self, user_goal: str, deadline: str = None, owner_id: int = None):
-    cache_key = f"plan:{user_goal.lower().strip()}"
-    cached_result = redis_client.get(cache_key)
+    # Fixed-size key however long the goal is; also names the single-flight lock and channel
+    goal_hash = hashlib.blake2b(normalize_goal(user_goal).encode(), digest_size=16).hexdigest()
+    cache_key = f"plan:{goal_hash}"
+    lock_key = _plan_lock_key(goal_hash, owner_id)
+    # Cache lookup and idempotency lock share one round-trip; the lock starts short-lived
+    # so a worker dying mid-generation doesn't block a retry for the full hour.
+    # The lock holds this task's id: with acks_late a dead worker's task is redelivered under
+    # the same id, and that run must still count as the owner and save the plan.
+    task_id = self.request.id or str(uuid.uuid4())
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(cache_key)
+        pipe.set(lock_key, task_id, nx=True, ex=PLAN_LOCK_PENDING_TTL)
+        pipe.get(lock_key)
+        cached_result, acquired, lock_holder = pipe.execute()
+    got_lock = bool(acquired) or lock_holder == task_id.encode()
     if cached_result:
-        return json.loads(cached_result)
+        plan = _unpack_plan(cached_result)
+        # Still persist for this owner so the plan shows up on their profile
+        if got_lock:
+            _save_plan_to_db(user_goal, plan, owner_id, lock_key)
+            _mark_plan_saved(lock_key)
+        return {"id": str(uuid.uuid4()), "plan": plan}
+
+    # Paraphrased goals miss the exact key, so check the nearest stored goal before calling the model
+    embedding = semantic_cache.embed(user_goal)
+    cached_result = semantic_cache.lookup(redis_client, embedding)
+    # Single-flight: the first worker for a goal calls the model, concurrent ones wait for its result
+    flight_key = f"plan:flight:{goal_hash}"
+    leader = False
+    if not cached_result:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(flight_key, task_id, nx=True, ex=PLAN_FLIGHT_TTL)
+            pipe.get(flight_key)
+            acquired, flight_holder = pipe.execute()
+        # A redelivered run finds its own id on the lock and leads again rather than waiting on itself
+        leader = bool(acquired) or flight_holder == task_id.encode()
+        if not leader:
+            cached_result = _wait_for_inflight_plan(goal_hash, cache_key, flight_key)
+    if cached_result:
+        plan = _unpack_plan(cached_result)
+        redis_client.set(cache_key, cached_result, ex=3600)
+        if got_lock:
+            _save_plan_to_db(user_goal, plan, owner_id, lock_key)
+            _mark_plan_saved(lock_key)
+        return {"id": str(uuid.uuid4()), "plan": plan}
 
-    plan_id = str(uuid.uuid4())
     try:
-        if openai and OPENAI_KEY:
-            prompt = (
-                "You are an expert project planner. Given a short user goal, break it into an ordered list of tasks. "
-                "Return JSON: {title, generated_by, tasks:[{id,title,duration_days,dependencies,priority,notes}], created_at}.\n\n"
-                f"Goal: {user_goal}\n"
-            )
-            if deadline:
-                prompt += f"Deadline: {deadline}\n"
-            prompt += "Return only JSON."
-
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=800,
-                temperature=0.2,
-            )
-            content = response['choices'][0]['message']['content']
-            try:
-                plan = json.loads(content)
-            except Exception:
-                import re
-                match = re.search(r"\{.*\}", content, re.DOTALL)
-                if match:
-                    plan = json.loads(match.group(0))
-                else:
-                    raise
-            plan.setdefault('created_at', str(datetime.datetime.utcnow()))
-            plan['generated_by'] = 'openai'
-        else:
-            raise RuntimeError("OpenAI not configured")
+        with _flight_heartbeat(flight_key, task_id) if leader else nullcontext():
+            if OPENAI_KEY and _get_openai():
+                response = _create_completion_with_backoff(
+                    model="gpt-4o",
+                    messages=[
+                        {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
+                        {"role": "user", "content": _PLANNER_USER_PROMPT(goal=user_goal, deadline=deadline or "none")},
+                    ],
+                    max_tokens=800,
+                    temperature=0.2,
+                    stream=True,
+                )
+                content = _collect_streamed_content(self, response)
+                try:
+                    plan = orjson.loads(content)
+                except Exception:
+                    match = _JSON_OBJECT_RE.search(content)
+                    if match:
+                        plan = orjson.loads(match.group(0))
+                    else:
+                        raise
+                plan.setdefault('created_at', str(datetime.datetime.utcnow()))
+                plan['generated_by'] = 'openai'
+            else:
+                raise RuntimeError("OpenAI not configured")
     except Exception as e:
         plan = rule_based_planner(user_goal, deadline)
         plan['fallback_reason'] = str(e)
 
     plan_id = str(uuid.uuid4())
-    _save_plan_to_db(user_goal, plan, owner_id)
-    redis_client.set(cache_key, json.dumps(plan), ex=3600)
+    payload = _pack_plan(plan)
+    # Cache write, waiter wake-up and flight-lock release in one round-trip, before the DB save so
+    # coalesced workers aren't held up by it. The owner lock keeps its short TTL until the
+    # save has returned, so a worker killed in between doesn't block a retry for an hour.
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(cache_key, payload, ex=3600)
+        if leader:
+            pipe.publish(f"plan:done:{goal_hash}", payload)
+            pipe.delete(flight_key)
+        pipe.execute()
+    if got_lock:
+        _save_plan_to_db(user_goal, plan, owner_id, lock_key)
+        _mark_plan_saved(lock_key)
+    if plan.get('generated_by') == 'openai':
+        # Only model output is worth matching paraphrases against; fallbacks are cheap to rebuild
+        semantic_cache.store(redis_client, embedding, payload)
     return {"id": plan_id, "plan": plan}
 
-def rule_based_planner(goal_text, deadline_date=None):
+def _pack_plan(plan: dict) -> bytes:
+    # msgpack is more compact than JSON text for the repeated task keys
+    return msgpack.packb(plan, use_bin_type=True)
+
+def _unpack_plan(data: bytes) -> dict:
+    return msgpack.unpackb(data, raw=False)
+
+@contextmanager
+def _flight_heartbeat(flight_key: str, task_id: str):
+    """Renew the flight lock while the leader generates, so waiters follow a slow model call
+    instead of timing out and calling it themselves. Stops at PLAN_GENERATION_TIMEOUT, or as
+    soon as the lock is no longer ours."""
+    stop = threading.Event()
+
+    def refresh():
+        deadline = time.monotonic() + PLAN_GENERATION_TIMEOUT
+        while not stop.wait(PLAN_FLIGHT_TTL / 3) and time.monotonic() < deadline:
+            try:
+                if not _refresh_flight(keys=[flight_key], args=[task_id, PLAN_FLIGHT_TTL]):
+                    return
+            except redis.RedisError:
+                # A missed renewal only risks a duplicate generation; try again next beat
+                pass
+
+    # A plain thread becomes a greenlet under -P gevent
+    beat = threading.Thread(target=refresh, name=f"flight-heartbeat-{task_id}", daemon=True)
+    beat.start()
+    try:
+        yield
+    finally:
+        stop.set()
+
+def _wait_for_inflight_plan(goal_hash: str, cache_key: str, flight_key: str, timeout: float = None):
+    """Wait for the worker holding the flight lock to publish its plan; None once the lock is gone
+    without a result, or after `timeout` (default PLAN_GENERATION_TIMEOUT)."""
+    timeout = PLAN_GENERATION_TIMEOUT if timeout is None else timeout
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(f"plan:done:{goal_hash}")
+        # The leader may have finished between our lock attempt and the subscribe
+        cached = redis_client.get(cache_key)
+        if cached:
+            return cached
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            message = pubsub.get_message(timeout=min(remaining, PLAN_FLIGHT_TTL / 3))
+            if message and message["type"] == "message":
+                return message["data"]
+            # A live leader keeps renewing the lock; once it has lapsed the leader is gone
+            if message is None and not redis_client.exists(flight_key):
+                break
+        # Leader died or finished while we checked; re-read once, then the caller generates itself
+        return redis_client.get(cache_key)
+    finally:
+        pubsub.close()
+
+def _create_completion_with_backoff(max_retries: int = 3, **request):
+    # Pace against the shared per-key budget up front, then wait out any 429s that still
+    # happen (honoring Retry-After) before giving up to the rule-based planner
+    prompt_text = "".join(message["content"] for message in request["messages"])
+    estimated = rate_limit.estimate_tokens(prompt_text) + request.get("max_tokens", 0)
+    for attempt in range(max_retries + 1):
+        try:
+            wait = rate_limit.acquire(redis_client, OPENAI_KEY, estimated)
+        except redis.RedisError:
+            # The limiter is advisory; the backoff below still covers a Redis outage
+            wait = 0
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            return _get_openai_client().chat.completions.create(**request)
+        except _get_openai().RateLimitError as e:
+            delay = retry_delay(e, attempt) if attempt < max_retries else None
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+def _collect_streamed_content(task, chunks, min_interval: float = 0.5):
+    # Publish partial text as PROGRESS so the SSE stream shows output before the model finishes;
+    # throttled so a fast stream doesn't turn into one result-backend write per token
+    parts = []
+    last_update = 0.0
+    for chunk in chunks:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            continue
+        parts.append(delta)
+        now = time.monotonic()
+        if now - last_update >= min_interval:
+            task.update_state(state='PROGRESS', meta={'partial': ''.join(parts)})
+            last_update = now
+    return ''.join(parts)
+
+def enqueue_plan_generation(user_goal: str, deadline: str = None, owner_id: int = None):
+    task_id = str(uuid.uuid4())
+    if owner_id is not None:
+        # Stamped before publishing so the status endpoints can check ownership from the first request
+        celery_app.backend.client.set(task_owner_key(task_id), owner_id, ex=celery_app.conf.result_expires)
+    # Reuse a pooled broker connection instead of acquiring a fresh one per publish
+    with celery_app.producer_pool.acquire(block=True) as producer:
+        return generate_plan_task.apply_async(args=(user_goal, deadline, owner_id), task_id=task_id, producer=producer)
+
+@lru_cache(maxsize=1)
+def _canonical_plan_structure():
+    # Date-independent part of the fallback plan: (title, duration, day offset) per step
     canonical_steps = [
         ("Clarify goal & constraints", 1),
         ("Research & gather requirements", 2),
@@ -79,11 +328,20 @@ def rule_based_planner(goal_text, deadline_date=None):
         ("Launch / deliver", 1),
         ("Monitor & iterate", 3),
     ]
-    tasks = []
+    structure = []
     current_day_offset = 0
-    for i, (title, dur) in enumerate(canonical_steps, start=1):
+    for title, dur in canonical_steps:
         dur_adj = max(1, int(round(dur)))
-        start_date = datetime.date.today() + datetime.timedelta(days=current_day_offset)
+        structure.append((title, dur_adj, current_day_offset))
+        current_day_offset += dur_adj
+    return tuple(structure)
+
+def rule_based_planner(goal_text, deadline_date=None):
+    today = datetime.date.today()
+    notes = f"Auto-generated from goal: {goal_text[:120]}"
+    tasks = []
+    for i, (title, dur_adj, day_offset) in enumerate(_canonical_plan_structure(), start=1):
+        start_date = today + datetime.timedelta(days=day_offset)
         end_date = start_date + datetime.timedelta(days=dur_adj - 1)
         tasks.append({
             "id": f"t{i}",
@@ -93,9 +351,8 @@ def rule_based_planner(goal_text, deadline_date=None):
             "end_date": str(end_date),
             "dependencies": [f"t{i-1}"] if i > 1 else [],
             "priority": "medium",
-            "notes": f"Auto-generated from goal: {goal_text[:120]}"
+            "notes": notes
         })
-        current_day_offset += dur_adj
     return {
         "title": goal_text,
         "generated_by": "rule_based",
@@ -103,26 +360,86 @@ def rule_based_planner(goal_text, deadline_date=None):
         "created_at": str(datetime.datetime.utcnow())
     }
 
-def _save_plan_to_db(user_goal: str, plan_data: dict, owner_id: int = None):
-    with Session(engine) as session:
-        statement = select(Plan).where(Plan.user_goal == user_goal)
-        existing_plan = session.exec(statement).first()
-        if existing_plan:
-            return
-        new_plan = Plan(user_goal=user_goal, owner_id=owner_id)
-        session.add(new_plan)
+def _plan_lock_key(goal_hash: str, owner_id: int = None) -> str:
+    # Redis SET NX is the idempotency gate instead of a SELECT round-trip to the database.
+    # Duplicates are per owner: another user asking for the same goal still gets their own plan.
+    return f"planlock:{owner_id}:{goal_hash}"
+
+def _mark_plan_saved(lock_key: str):
+    # Replace the task id so a redelivery of this (already saved) task no longer owns the lock
+    redis_client.set(lock_key, PLAN_LOCK_SAVED, ex=PLAN_LOCK_TTL)
+
+def _save_plan_to_db(user_goal: str, plan_data: dict, owner_id: int = None, lock_key: str = None):
+    """Insert the plan; the caller must already hold lock_key."""
+    try:
+        _insert_plan(user_goal, plan_data, owner_id)
+    except Exception:
+        # Let a retry save the plan instead of being locked out
+        if lock_key:
+            redis_client.delete(lock_key)
+        raise
+
+# Task columns that differ per row; everything else is the same for all tasks of a plan
+_TASK_ARRAY_COLUMNS = ('taskName', 'description', 'duration', 'dependencies', 'priority')
+
+def _insert_plan(user_goal: str, plan_data: dict, owner_id: int = None):
+    now = datetime.datetime.utcnow()
+    task_rows = [
+        {
+            'taskName': task_data.get('title', ''),
+            'description': task_data.get('notes', ''),
+            'duration': str(task_data.get('duration_days', '')),
+            'dependencies': ','.join(task_data.get('dependencies', [])) if isinstance(task_data.get('dependencies', []), list) else str(task_data.get('dependencies', '')),
+            'priority': task_data.get('priority', 'medium'),
+        }
+        for task_data in plan_data.get("tasks", [])
+    ]
+    with Session(get_engine()) as session:
+        if session.get_bind().dialect.name == "postgresql" and task_rows:
+            session.execute(_plan_with_tasks_insert(user_goal, owner_id, task_rows, now))
+        else:
+            new_plan = Plan(user_goal=user_goal, owner_id=owner_id, created_at=now)
+            session.add(new_plan)
+            # Flush assigns the plan id without ending the transaction, so plan and tasks commit once
+            session.flush()
+            # One executemany INSERT instead of validating and adding a Task object per row
+            if task_rows:
+                session.execute(insert(Task), [
+                    {**row, 'phase': '', 'status': TaskStatus.REJECTED, 'created_at': now, 'updated_at': now, 'plan_id': new_plan.id}
+                    for row in task_rows
+                ])
         session.commit()
-        session.refresh(new_plan)
-        for task_data in plan_data.get("tasks", []):
-            mapped_task = {
-                'taskName': task_data.get('title', ''),
-                'description': task_data.get('notes', ''),
-                'duration': str(task_data.get('duration_days', '')),
-                'dependencies': ','.join(task_data.get('dependencies', [])) if isinstance(task_data.get('dependencies', []), list) else str(task_data.get('dependencies', '')),
-                'phase': '',
-                'priority': task_data.get('priority', 'medium'),
-                'plan_id': new_plan.id
-            }
-            new_task = Task.model_validate(mapped_task)
-            session.add(new_task)
-        session.commit()
\ No newline at end of file
+
+def _plan_with_tasks_insert(user_goal: str, owner_id: int, task_rows: list, now: datetime.datetime):
+    """Postgres: insert the plan and all of its tasks in one statement.
+    Multi-array unnest names every output column "unnest", so the alias must carry a column list.
+
+    WITH new_plan AS (INSERT INTO plan ... RETURNING id)
+    INSERT INTO task (...) SELECT t.*, <constants>, new_plan.id FROM new_plan, unnest(<arrays>) AS t
+    """
+    new_plan = (
+        insert(Plan)
+        .values(user_goal=user_goal, owner_id=owner_id, created_at=now)
+        .returning(Plan.id)
+        .cte("new_plan")
+    )
+    rows = func.unnest(*[
+        # Explicit casts so the arrays are typed even if the driver sends them as untyped literals
+        cast(bindparam(f"{name}_values", [row[name] for row in task_rows], type_=ARRAY(String)), ARRAY(String))
+        for name in _TASK_ARRAY_COLUMNS
+    ]).table_valued(*_TASK_ARRAY_COLUMNS).render_derived(name="t")
+    task_columns = Task.__table__.c
+    source = select(
+        *[rows.c[name] for name in _TASK_ARRAY_COLUMNS],
+        literal('', String),
+        # Start as not submitted, same as the inline path
+        literal(TaskStatus.REJECTED, task_columns.status.type),
+        literal(now, task_columns.created_at.type),
+        literal(now, task_columns.updated_at.type),
+        new_plan.c.id,
+    ).select_from(new_plan.join(rows, true()))
+    return (
+        insert(Task)
+        .from_select([*_TASK_ARRAY_COLUMNS, 'phase', 'status', 'created_at', 'updated_at', 'plan_id'], source)
+        .add_cte(new_plan)
+    )
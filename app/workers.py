@@ -0,0 +1,10 @@
+from uvicorn.workers import UvicornWorker
+
+class UvloopWorker(UvicornWorker):
+    # Pin the C-accelerated event loop and HTTP parser shipped with uvicorn[standard]
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "loop": "uvloop",
+        "http": "httptools",
+        "backlog": 2048,
+    }